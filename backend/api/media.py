@@ -1,8 +1,11 @@
+import asyncio
+
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, func
+from sqlalchemy.orm import raiseload
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import AliasChoices, BaseModel, Field, field_validator
 from datetime import datetime
 
 from core.database import get_db
@@ -25,7 +28,7 @@ class MediaResponse(BaseModel):
     height: Optional[int]
     duration: Optional[float]
     caption: Optional[str]
-    tags: List[str]
+    tags: List[str] = Field(validation_alias=AliasChoices("ai_tags", "tags"))
     title: Optional[str]
     description: Optional[str]
     license_type: str
@@ -35,6 +38,11 @@ class MediaResponse(BaseModel):
     created_at: datetime
     processed_at: Optional[datetime]
     
+    @field_validator("tags", mode="before")
+    @classmethod
+    def _tags_or_empty(cls, v):
+        return v or []
+    
     class Config:
         from_attributes = True
 
@@ -54,6 +62,18 @@ class MediaListResponse(BaseModel):
     pages: int
 
 
+def _media_response(
+    media: Media,
+    preview_url: str,
+    thumbnail_url: Optional[str]
+) -> MediaResponse:
+    """Build the response straight from the ORM row"""
+    # URLs ride along as transient (unmapped) attributes on the instance
+    media.preview_url = preview_url
+    media.thumbnail_url = thumbnail_url
+    return MediaResponse.model_validate(media)
+
+
 @router.get("/{media_id}", response_model=MediaResponse)
 async def get_media(
     media_id: int,
@@ -67,7 +87,7 @@ async def get_media(
                 Media.id == media_id,
                 Media.user_id == current_user.id
             )
-        )
+        ).options(raiseload("*"))
     )
     media = result.scalar_one_or_none()
     
@@ -80,27 +100,7 @@ async def get_media(
     if media.thumbnail_path:
         thumbnail_url = storage_service.get_file_url(media.thumbnail_path)
     
-    return MediaResponse(
-        id=media.id,
-        filename=media.filename,
-        original_filename=media.original_filename,
-        file_type=media.file_type,
-        mime_type=media.mime_type,
-        file_size=media.file_size,
-        width=media.width,
-        height=media.height,
-        duration=media.duration,
-        caption=media.caption,
-        tags=media.ai_tags or [],
-        title=media.title,
-        description=media.description,
-        license_type=media.license_type,
-        price=media.price,
-        preview_url=preview_url,
-        thumbnail_url=thumbnail_url,
-        created_at=media.created_at,
-        processed_at=media.processed_at
-    )
+    return _media_response(media, preview_url, thumbnail_url)
 
 
 @router.get("/", response_model=MediaListResponse)
@@ -113,8 +113,10 @@ async def list_media(
     db: AsyncSession = Depends(get_db)
 ):
     """List user's media with pagination"""
-    # Build query
-    query = select(Media).where(Media.user_id == current_user.id)
+    # Build query; the total is computed alongside the page rows
+    query = select(Media, func.count().over().label("total")).where(
+        Media.user_id == current_user.id
+    ).options(raiseload("*"))
     
     if file_type:
         query = query.where(Media.file_type == file_type)
@@ -122,54 +124,39 @@ async def list_media(
     if processed_only:
         query = query.where(Media.processed_at.isnot(None))
     
-    # Get total count
-    count_query = select(func.count()).select_from(Media).where(Media.user_id == current_user.id)
-    if file_type:
-        count_query = count_query.where(Media.file_type == file_type)
-    if processed_only:
-        count_query = count_query.where(Media.processed_at.isnot(None))
-    
-    total_result = await db.execute(count_query)
-    total = total_result.scalar()
-    
-    # Calculate pagination
-    total_pages = (total + page_size - 1) // page_size
     offset = (page - 1) * page_size
     
     # Get items
     query = query.order_by(Media.created_at.desc()).offset(offset).limit(page_size)
     result = await db.execute(query)
-    media_items = result.scalars().all()
+    rows = result.all()
+    media_items = [media for media, _ in rows]
+    
+    if rows:
+        total = rows[0].total
+    elif offset:
+        # Past the last page: the window has no rows to report the total on
+        count_query = select(func.count()).select_from(query.order_by(None).limit(None).offset(None).subquery())
+        total = (await db.execute(count_query)).scalar()
+    else:
+        total = 0
+    
+    # Calculate pagination
+    total_pages = (total + page_size - 1) // page_size
+    
+    # Generate URLs for the whole page at once
+    paths = [m.storage_path for m in media_items] + [
+        m.thumbnail_path for m in media_items if m.thumbnail_path
+    ]
+    urls = await asyncio.to_thread(storage_service.get_file_urls_batch, paths)
     
     # Build response
     items = []
     for media in media_items:
-        preview_url = storage_service.get_file_url(media.storage_path)
-        thumbnail_url = None
-        if media.thumbnail_path:
-            thumbnail_url = storage_service.get_file_url(media.thumbnail_path)
+        preview_url = urls[media.storage_path]
+        thumbnail_url = urls.get(media.thumbnail_path) if media.thumbnail_path else None
         
-        items.append(MediaResponse(
-            id=media.id,
-            filename=media.filename,
-            original_filename=media.original_filename,
-            file_type=media.file_type,
-            mime_type=media.mime_type,
-            file_size=media.file_size,
-            width=media.width,
-            height=media.height,
-            duration=media.duration,
-            caption=media.caption,
-            tags=media.ai_tags or [],
-            title=media.title,
-            description=media.description,
-            license_type=media.license_type,
-            price=media.price,
-            preview_url=preview_url,
-            thumbnail_url=thumbnail_url,
-            created_at=media.created_at,
-            processed_at=media.processed_at
-        ))
+        items.append(_media_response(media, preview_url, thumbnail_url))
     
     return MediaListResponse(
         items=items,
@@ -193,63 +180,48 @@ async def update_media(
                 Media.id == media_id,
                 Media.user_id == current_user.id
             )
-        )
+        ).options(raiseload("*"))
     )
     media = result.scalar_one_or_none()
     
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
     
-    # Update fields
-    if media_update.title is not None:
-        media.title = media_update.title
-    if media_update.description is not None:
-        media.description = media_update.description
-    if media_update.license_type is not None:
-        media.license_type = media_update.license_type
-    if media_update.price is not None:
-        media.price = media_update.price
-    if media_update.tags is not None:
+    # Update only the fields that actually change
+    dirty = False
+    for field in ("title", "description", "license_type", "price"):
+        value = getattr(media_update, field)
+        if value is not None and value != getattr(media, field):
+            setattr(media, field, value)
+            dirty = True
+    
+    tags_changed = (
+        media_update.tags is not None
+        and set(media_update.tags) != set(media.ai_tags or [])
+    )
+    if tags_changed:
         media.ai_tags = media_update.tags
+        dirty = True
+    
+    if dirty:
+        media.updated_at = datetime.utcnow()
+        # Sessions don't expire on commit, so the in-memory row is current
+        await db.commit()
+        
         # Update vector database metadata
-        if media.embedding_id:
-            vector_service.update_metadata(
+        if tags_changed and media.embedding_id:
+            await vector_service.async_update_metadata(
                 media.embedding_id,
                 {"tags": media_update.tags}
             )
     
-    media.updated_at = datetime.utcnow()
-    
-    await db.commit()
-    await db.refresh(media)
-    
     # Generate URLs
     preview_url = storage_service.get_file_url(media.storage_path)
     thumbnail_url = None
     if media.thumbnail_path:
         thumbnail_url = storage_service.get_file_url(media.thumbnail_path)
     
-    return MediaResponse(
-        id=media.id,
-        filename=media.filename,
-        original_filename=media.original_filename,
-        file_type=media.file_type,
-        mime_type=media.mime_type,
-        file_size=media.file_size,
-        width=media.width,
-        height=media.height,
-        duration=media.duration,
-        caption=media.caption,
-        tags=media.ai_tags or [],
-        title=media.title,
-        description=media.description,
-        license_type=media.license_type,
-        price=media.price,
-        preview_url=preview_url,
-        thumbnail_url=thumbnail_url,
-        created_at=media.created_at,
-        processed_at=media.processed_at
-    )
+    return _media_response(media, preview_url, thumbnail_url)
 
 
 @router.delete("/{media_id}")
@@ -274,13 +246,13 @@ async def delete_media(
     
     try:
         # Delete from storage
-        storage_service.delete_file(media.storage_path)
+        await asyncio.to_thread(storage_service.delete_file, media.storage_path)
         if media.thumbnail_path:
-            storage_service.delete_file(media.thumbnail_path)
+            await asyncio.to_thread(storage_service.delete_file, media.thumbnail_path)
         
         # Delete from vector database
         if media.embedding_id:
-            vector_service.delete_embedding(media.embedding_id)
+            await vector_service.async_delete_embedding(media.embedding_id)
         
         # Delete from database
         await db.delete(media)
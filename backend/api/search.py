@@ -1,6 +1,11 @@
+import asyncio
+import re
+
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, and_
+from sqlalchemy import select, and_, func, literal, literal_column, true, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import raiseload
 from typing import List, Optional
 from pydantic import BaseModel
 
@@ -13,6 +18,11 @@ from services.storage_service import storage_service
 
 router = APIRouter()
 
+# Generated tsvector column maintained by Postgres (see core.database.MEDIA_DDL)
+search_tsv = literal_column("media.search_tsv")
+# Filename separators replaced by spaces before indexing
+_FILENAME_SEPARATORS_RE = re.compile(r"[._-]+")
+
 
 class SearchResult(BaseModel):
     id: int
@@ -46,26 +56,29 @@ async def semantic_search(
     """Perform semantic search using natural language"""
     try:
         # Convert query to embedding
-        query_embedding = ai_service.search_by_text(search_request.query)
+        query_embedding = await ai_service.asearch_by_text(search_request.query)
         
         # Search in vector database
-        filters = {}
+        filters = {"user_id": current_user.id}
         if search_request.file_type:
             filters["file_type"] = search_request.file_type
         if search_request.tags:
             filters["tags"] = search_request.tags
         
-        vector_results = vector_service.search_similar(
+        vector_results = await vector_service.async_search_similar(
             query_embedding.tolist(),
             limit=search_request.limit,
             score_threshold=search_request.min_score,
             filters=filters
         )
         
-        # Get media details from database
-        media_ids = [r["media_id"] for r in vector_results]
-        if not media_ids:
+        # Get media details from database, keeping Qdrant's score order
+        scores = {}
+        for r in vector_results:
+            scores.setdefault(r["media_id"], r["score"])
+        if not scores:
             return []
+        media_ids = list(scores)
         
         result = await db.execute(
             select(Media).where(
@@ -73,35 +86,38 @@ async def semantic_search(
                     Media.id.in_(media_ids),
                     Media.user_id == current_user.id
                 )
-            )
+            ).order_by(
+                func.array_position(literal(media_ids, ARRAY(Integer)), Media.id)
+            ).options(raiseload("*"))
         )
-        media_items = {m.id: m for m in result.scalars().all()}
+        media_items = result.scalars().all()
+        
+        # Generate URLs for all hits at once
+        paths = [m.storage_path for m in media_items] + [
+            m.thumbnail_path for m in media_items if m.thumbnail_path
+        ]
+        urls = await asyncio.to_thread(storage_service.get_file_urls_batch, paths)
         
         # Build response
         search_results = []
-        for vr in vector_results:
-            media = media_items.get(vr["media_id"])
-            if media:
-                # Generate URLs
-                preview_url = storage_service.get_file_url(media.storage_path)
-                thumbnail_url = None
-                if media.thumbnail_path:
-                    thumbnail_url = storage_service.get_file_url(media.thumbnail_path)
-                
-                search_results.append(SearchResult(
-                    id=media.id,
-                    filename=media.filename,
-                    original_filename=media.original_filename,
-                    file_type=media.file_type,
-                    caption=media.caption,
-                    tags=media.ai_tags or [],
-                    score=vr["score"],
-                    thumbnail_url=thumbnail_url,
-                    preview_url=preview_url,
-                    width=media.width,
-                    height=media.height,
-                    duration=media.duration
-                ))
+        for media in media_items:
+            preview_url = urls[media.storage_path]
+            thumbnail_url = urls.get(media.thumbnail_path) if media.thumbnail_path else None
+            
+            search_results.append(SearchResult(
+                id=media.id,
+                filename=media.filename,
+                original_filename=media.original_filename,
+                file_type=media.file_type,
+                caption=media.caption,
+                tags=media.ai_tags or [],
+                score=scores[media.id],
+                thumbnail_url=thumbnail_url,
+                preview_url=preview_url,
+                width=media.width,
+                height=media.height,
+                duration=media.duration
+            ))
         
         return search_results
         
@@ -121,47 +137,37 @@ async def keyword_search(
     """Perform keyword search on metadata"""
     try:
         # Build query
-        query = select(Media).where(Media.user_id == current_user.id)
-        
-        # Add search conditions
-        search_conditions = []
-        
-        # Search in filename, title, description, caption
-        search_pattern = f"%{q}%"
-        search_conditions.append(
-            or_(
-                Media.original_filename.ilike(search_pattern),
-                Media.title.ilike(search_pattern),
-                Media.description.ilike(search_pattern),
-                Media.caption.ilike(search_pattern)
-            )
-        )
+        query = select(Media).where(Media.user_id == current_user.id).options(raiseload("*"))
         
-        if search_conditions:
-            query = query.where(and_(*search_conditions))
+        # Full-text match in filename, title, description, caption
+        # Split the query on filename separators the same way as the column
+        ts_query = func.plainto_tsquery("simple", _FILENAME_SEPARATORS_RE.sub(" ", q))
+        query = query.where(search_tsv.op("@@")(ts_query))
         
         # Filter by file type
         if file_type:
             query = query.where(Media.file_type == file_type)
         
-        # Filter by tags (using JSON contains)
+        # Filter by tags: one JSONB containment (@>) requiring all of them
         if tags:
-            for tag in tags:
-                query = query.where(Media.ai_tags.contains([tag]))
+            query = query.where(Media.ai_tags.contains(tags))
         
-        # Execute query
-        query = query.limit(limit)
+        # Execute query, best matches first
+        query = query.order_by(func.ts_rank_cd(search_tsv, ts_query).desc()).limit(limit)
         result = await db.execute(query)
         media_items = result.scalars().all()
         
+        # Generate URLs for all hits at once
+        paths = [m.storage_path for m in media_items] + [
+            m.thumbnail_path for m in media_items if m.thumbnail_path
+        ]
+        urls = await asyncio.to_thread(storage_service.get_file_urls_batch, paths)
+        
         # Build response
         search_results = []
         for media in media_items:
-            # Generate URLs
-            preview_url = storage_service.get_file_url(media.storage_path)
-            thumbnail_url = None
-            if media.thumbnail_path:
-                thumbnail_url = storage_service.get_file_url(media.thumbnail_path)
+            preview_url = urls[media.storage_path]
+            thumbnail_url = urls.get(media.thumbnail_path) if media.thumbnail_path else None
             
             search_results.append(SearchResult(
                 id=media.id,
@@ -192,33 +198,27 @@ async def get_popular_tags(
 ):
     """Get popular tags from user's media"""
     try:
-        # Get all tags from user's media
+        # Unnest and count tags in Postgres; only the top rows come back
+        tag = func.jsonb_array_elements_text(Media.ai_tags).table_valued("tag").lateral()
+        tag_count = func.count().label("count")
         result = await db.execute(
-            select(Media.ai_tags).where(
+            select(tag.c.tag, tag_count)
+            .select_from(Media)
+            .join(tag, true())
+            .where(
                 and_(
                     Media.user_id == current_user.id,
-                    Media.ai_tags.isnot(None)
+                    func.jsonb_typeof(Media.ai_tags) == "array"
                 )
             )
+            .group_by(tag.c.tag)
+            .order_by(tag_count.desc())
+            .limit(limit)
         )
         
-        # Count tag occurrences
-        tag_counts = {}
-        for row in result:
-            if row[0]:  # ai_tags
-                for tag in row[0]:
-                    tag_counts[tag] = tag_counts.get(tag, 0) + 1
-        
-        # Sort by count and return top tags
-        sorted_tags = sorted(
-            tag_counts.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:limit]
-        
         return [
-            {"tag": tag, "count": count}
-            for tag, count in sorted_tags
+            {"tag": tag_name, "count": count}
+            for tag_name, count in result
         ]
         
     except Exception as e:
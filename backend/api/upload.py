@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Tuple
+import asyncio
 import os
 import tempfile
 import magic
@@ -8,7 +9,7 @@ from datetime import datetime
 from sqlalchemy import select
 
 from core.database import get_db
-from core.config import settings
+from core.config import settings, MAX_UPLOAD_SIZE, ALLOWED_EXTENSIONS_SET
 from models.media import Media, User
 from api.auth import get_current_user
 from services.storage_service import storage_service
@@ -17,6 +18,17 @@ from pydantic import BaseModel
 
 router = APIRouter()
 
+IMAGE_EXTENSIONS = frozenset({"jpg", "jpeg", "png", "gif"})
+
+# Uploads are copied in chunks so a file is never held in memory whole
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# libmagic only needs the start of a file to identify it
+MIME_HEADER_SIZE = 4096
+
+# Loading the libmagic database is expensive; python-magic serializes
+# calls on an instance with its own lock, so one detector can be shared
+_MIME_DETECTOR = magic.Magic(mime=True)
+
 
 class UploadResponse(BaseModel):
     id: int
@@ -30,60 +42,53 @@ class UploadResponse(BaseModel):
 def validate_file(file: UploadFile) -> tuple[str, str]:
     """Validate uploaded file"""
     # Check file size
-    if file.size > settings.MAX_UPLOAD_SIZE:
+    if file.size > MAX_UPLOAD_SIZE:
         raise HTTPException(
             status_code=400,
-            detail=f"File too large. Maximum size is {settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB"
+            detail=f"File too large. Maximum size is {MAX_UPLOAD_SIZE / 1024 / 1024}MB"
         )
     
     # Check file extension
     file_ext = os.path.splitext(file.filename)[1].lower().replace(".", "")
-    if file_ext not in settings.ALLOWED_EXTENSIONS:
+    if file_ext not in ALLOWED_EXTENSIONS_SET:
         raise HTTPException(
             status_code=400,
             detail=f"File type not allowed. Allowed types: {', '.join(settings.ALLOWED_EXTENSIONS)}"
         )
     
     # Determine file type
-    file_type = "image" if file_ext in ["jpg", "jpeg", "png", "gif"] else "video"
+    file_type = "image" if file_ext in IMAGE_EXTENSIONS else "video"
     
     return file_ext, file_type
 
 
-@router.post("/single", response_model=UploadResponse)
-async def upload_single(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
-):
-    """Upload a single media file"""
+async def _prepare_upload(file: UploadFile, current_user: User) -> Tuple[Media, str]:
+    """Validate and store an uploaded file, returning its unsaved Media row and temp path"""
     # Validate file
     file_ext, file_type = validate_file(file)
     
     try:
-        # Save file temporarily
+        # Stream file to a temporary location, keeping the header for MIME sniffing
+        header = b""
         with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}") as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
             tmp_path = tmp_file.name
-        
-        # Reset file pointer
-        await file.seek(0)
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                if len(header) < MIME_HEADER_SIZE:
+                    header += chunk[:MIME_HEADER_SIZE - len(header)]
+                tmp_file.write(chunk)
         
         # Detect MIME type
-        mime = magic.Magic(mime=True)
-        mime_type = mime.from_file(tmp_path)
+        mime_type = _MIME_DETECTOR.from_buffer(header)
         
-        # Upload to storage
-        storage_path, file_size = storage_service.upload_file(
-            file.file,
+        # Upload to storage from the temporary file
+        storage_path, file_size = await asyncio.to_thread(
+            storage_service.upload_path,
+            tmp_path,
             file.filename,
             mime_type,
             current_user.id
         )
         
-        # Create database entry
         media_entry = Media(
             filename=os.path.basename(storage_path),
             original_filename=file.filename,
@@ -93,28 +98,70 @@ async def upload_single(
             storage_path=storage_path,
             user_id=current_user.id
         )
+        return media_entry, tmp_path
         
-        db.add(media_entry)
+    except Exception as e:
+        # Clean up on error
+        if 'tmp_path' in locals() and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _queue_processing(jobs: List[Tuple[int, str]]):
+    """Publish AI processing tasks (blocking; run in a worker thread)"""
+    for media_id, tmp_path in jobs:
+        process_media_task.apply_async(args=[media_id, tmp_path], ignore_result=True)
+
+
+async def _save_uploads(db: AsyncSession, prepared: List[Tuple[Media, str]]) -> List[UploadResponse]:
+    """Persist prepared uploads in one transaction, then queue them for AI processing"""
+    try:
+        db.add_all([media_entry for media_entry, _ in prepared])
+        # Primary keys come back from the INSERT itself; no refresh needed
         await db.commit()
-        await db.refresh(media_entry)
-        
-        # Queue for AI processing
-        process_media_task.delay(media_entry.id, tmp_path)
-        
-        return UploadResponse(
+    except Exception as e:
+        await db.rollback()
+        for _, tmp_path in prepared:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    # Queue for AI processing; publishing to the broker is blocking I/O
+    await asyncio.to_thread(
+        _queue_processing,
+        [(media_entry.id, tmp_path) for media_entry, tmp_path in prepared]
+    )
+    
+    responses = []
+    for media_entry, tmp_path in prepared:
+        responses.append(UploadResponse(
             id=media_entry.id,
             filename=media_entry.filename,
             original_filename=media_entry.original_filename,
             file_type=media_entry.file_type,
             status="processing",
             message="File uploaded successfully. AI processing started."
-        )
-        
-    except Exception as e:
-        # Clean up on error
-        if 'tmp_path' in locals() and os.path.exists(tmp_path):
-            os.unlink(tmp_path)
-        raise HTTPException(status_code=500, detail=str(e))
+        ))
+    return responses
+
+
+async def _prepare_bounded(file: UploadFile, current_user: User, semaphore: asyncio.Semaphore) -> Tuple[Media, str]:
+    """Prepare an upload while holding a slot of the bulk concurrency limit"""
+    async with semaphore:
+        return await _prepare_upload(file, current_user)
+
+
+@router.post("/single", response_model=UploadResponse)
+async def upload_single(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Upload a single media file"""
+    prepared = await _prepare_upload(file, current_user)
+    responses = await _save_uploads(db, [prepared])
+    return responses[0]
 
 
 @router.post("/bulk", response_model=List[UploadResponse])
@@ -131,19 +178,20 @@ async def upload_bulk(
             detail="Maximum 10 files can be uploaded at once"
         )
     
-    responses = []
+    # Store files concurrently, bounded to avoid overloading storage
+    semaphore = asyncio.Semaphore(settings.UPLOAD_CONCURRENCY)
+    results = await asyncio.gather(
+        *[_prepare_bounded(file, current_user, semaphore) for file in files],
+        return_exceptions=True
+    )
     
-    for file in files:
-        try:
-            # Process each file
-            response = await upload_single(
-                background_tasks,
-                file,
-                current_user,
-                db
-            )
-            responses.append(response)
-        except HTTPException as e:
+    # Save every successfully stored file in a single transaction
+    prepared = [result for result in results if not isinstance(result, BaseException)]
+    saved = iter(await _save_uploads(db, prepared) if prepared else [])
+    
+    responses = []
+    for file, result in zip(files, results):
+        if isinstance(result, BaseException):
             responses.append(
                 UploadResponse(
                     id=0,
@@ -151,9 +199,11 @@ async def upload_bulk(
                     original_filename=file.filename,
                     file_type="unknown",
                     status="error",
-                    message=e.detail
+                    message=result.detail if isinstance(result, HTTPException) else str(result)
                 )
             )
+        else:
+            responses.append(next(saved))
     
     return responses
 
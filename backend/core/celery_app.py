@@ -1,9 +1,17 @@
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 from core.config import settings
+import json
 import os
+import subprocess
 from datetime import datetime
+from fractions import Fraction
+from typing import Dict, Optional
 from PIL import Image
-import cv2
+import av
+import numpy as np
 
 # Create Celery instance
 celery_app = Celery(
@@ -26,24 +34,106 @@ celery_app.conf.update(
 )
 
 
+# Sync database access for tasks, created once per worker process
+_engine = None
+_SessionLocal = None
+
+
+def get_sync_session_factory() -> sessionmaker:
+    """Return the worker's session factory, creating the pooled engine on first use"""
+    global _engine, _SessionLocal
+    if _SessionLocal is None:
+        _engine = create_engine(
+            settings.DATABASE_URL,
+            pool_size=5,
+            pool_pre_ping=True,
+            pool_recycle=1800
+        )
+        _SessionLocal = sessionmaker(bind=_engine, autoflush=False)
+    return _SessionLocal
+
+
+@worker_process_init.connect
+def init_db_engine(**kwargs):
+    """Build the engine after fork so connections are never shared between workers"""
+    get_sync_session_factory()
+
+
+@worker_process_shutdown.connect
+def dispose_db_engine(**kwargs):
+    if _engine is not None:
+        _engine.dispose()
+
+
+def _probe_video(file_path: str) -> Dict:
+    """Read video dimensions, frame rate and duration from container metadata"""
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=width,height,r_frame_rate,nb_frames:format=duration",
+            "-of", "json",
+            file_path
+        ],
+        capture_output=True,
+        check=True,
+        text=True
+    )
+    probe = json.loads(result.stdout)
+    # No video stream or missing fields fall back to zeros, as cv2 did
+    streams = probe.get("streams") or [{}]
+    stream = streams[0]
+    
+    num, _, den = str(stream.get("r_frame_rate", "0/1")).partition("/")
+    try:
+        fps = float(Fraction(int(num), int(den or 1)))
+    except (ValueError, ZeroDivisionError):
+        # ffprobe reports "0/0" when the rate is unknown
+        fps = 0.0
+    duration = probe.get("format", {}).get("duration")
+    if duration not in (None, "N/A"):
+        duration = float(duration)
+    elif str(stream.get("nb_frames", "")).isdigit() and fps > 0:
+        duration = int(stream["nb_frames"]) / fps
+    else:
+        duration = 0
+    
+    return {
+        "width": int(stream.get("width") or 0),
+        "height": int(stream.get("height") or 0),
+        "fps": fps,
+        "duration": duration
+    }
+
+
+def _extract_keyframe(file_path: str, position: float) -> Optional[np.ndarray]:
+    """Decode the keyframe at or before `position` seconds as an RGB array"""
+    with av.open(file_path) as container:
+        if not container.streams.video:
+            return None
+        stream = container.streams.video[0]
+        # Only keyframes are decoded; everything in between is skipped
+        stream.codec_context.skip_frame = "NONKEY"
+        if position > 0 and stream.time_base:
+            container.seek(int(position / stream.time_base), stream=stream)
+        for frame in container.decode(stream):
+            return frame.to_ndarray(format="rgb24")
+    return None
+
+
 @celery_app.task(bind=True, max_retries=3)
 def process_media_task(self, media_id: int, file_path: str):
     """Process uploaded media file"""
     try:
         # Import here to avoid circular imports
-        from sqlalchemy import create_engine
-        from sqlalchemy.orm import sessionmaker
         from models.media import Media
         from services.ai_service import ai_service
         from services.vector_service import vector_service
         from services.storage_service import storage_service
         
-        # Create sync database session
-        engine = create_engine(settings.DATABASE_URL)
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        db = SessionLocal()
+        SessionLocal = get_sync_session_factory()
         
-        try:
+        with SessionLocal() as db:
             # Get media record
             media = db.query(Media).filter(Media.id == media_id).first()
             if not media:
@@ -75,6 +165,7 @@ def process_media_task(self, media_id: int, file_path: str):
                     ai_results["embedding"],
                     media_id,
                     {
+                        "user_id": media.user_id,
                         "file_type": media.file_type,
                         "caption": ai_results["caption"],
                         "tags": ai_results["tags"],
@@ -86,33 +177,27 @@ def process_media_task(self, media_id: int, file_path: str):
                 
             elif media.file_type == "video":
                 # Get video properties
-                cap = cv2.VideoCapture(file_path)
-                media.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                media.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                fps = cap.get(cv2.CAP_PROP_FPS)
-                frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                media.duration = frame_count / fps if fps > 0 else 0
+                video_info = _probe_video(file_path)
+                media.width = video_info["width"]
+                media.height = video_info["height"]
+                media.duration = video_info["duration"]
                 
-                # Extract key frame for thumbnail and AI processing
-                cap.set(cv2.CAP_PROP_POS_FRAMES, min(30, frame_count // 2))
-                ret, frame = cap.read()
-                cap.release()
+                # Extract key frame for thumbnail and AI processing,
+                # 30 frames in (or mid-video for short clips)
+                fps = video_info["fps"]
+                position = min(30 / fps, media.duration / 2) if fps > 0 else 0
+                frame_rgb = _extract_keyframe(file_path, position)
                 
-                if ret:
-                    # Save frame as temporary image
-                    temp_image_path = f"{file_path}_frame.jpg"
-                    cv2.imwrite(temp_image_path, frame)
-                    
+                if frame_rgb is not None:
                     # Generate thumbnail from frame
-                    with open(temp_image_path, 'rb') as f:
-                        thumbnail_path = storage_service.generate_thumbnail(
-                            f,
-                            media.original_filename
-                        )
-                        media.thumbnail_path = thumbnail_path
+                    thumbnail_path = storage_service.generate_thumbnail(
+                        Image.fromarray(frame_rgb),
+                        media.original_filename
+                    )
+                    media.thumbnail_path = thumbnail_path
                     
                     # Process frame with AI
-                    ai_results = ai_service.process_image(temp_image_path)
+                    ai_results = ai_service.process_image_array(frame_rgb)
                     
                     # Update media record
                     media.caption = f"Video: {ai_results['caption']}"
@@ -123,6 +208,7 @@ def process_media_task(self, media_id: int, file_path: str):
                         ai_results["embedding"],
                         media_id,
                         {
+                            "user_id": media.user_id,
                             "file_type": media.file_type,
                             "caption": media.caption,
                             "tags": ai_results["tags"],
@@ -131,9 +217,6 @@ def process_media_task(self, media_id: int, file_path: str):
                         }
                     )
                     media.embedding_id = embedding_id
-                    
-                    # Clean up temp file
-                    os.unlink(temp_image_path)
             
             # Mark as processed
             media.processed_at = datetime.utcnow()
@@ -145,9 +228,6 @@ def process_media_task(self, media_id: int, file_path: str):
             
             return {"status": "success", "media_id": media_id}
             
-        finally:
-            db.close()
-            
     except Exception as e:
         # Retry with exponential backoff
         raise self.retry(exc=e, countdown=2 ** self.request.retries) 
\ No newline at end of file
@@ -1,30 +1,66 @@
-from sqlalchemy import create_engine
+from uuid import uuid4
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from core.config import settings
 
+# Connection options for asyncpg
+connect_args = {}
+if settings.DB_PGBOUNCER:
+    # Prepared statements don't survive PgBouncer transaction pooling, and
+    # asyncpg's per-connection statement names would collide on shared backends.
+    # PgBouncer also rejects the jit startup parameter, so turn it off on the
+    # server instead: ALTER ROLE/DATABASE ... SET jit = off
+    connect_args["statement_cache_size"] = 0
+    connect_args["prepared_statement_cache_size"] = 0
+    connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+else:
+    # Planner JIT only adds latency to short OLTP queries
+    connect_args["server_settings"] = {"jit": "off"}
+
 # Create async engine
 engine = create_async_engine(
     settings.DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://"),
-    echo=True,
-    future=True
+    echo=settings.DB_ECHO,
+    future=True,
+    pool_size=20,
+    max_overflow=10,
+    pool_timeout=30,
+    pool_pre_ping=True,  # Drop connections the server has closed
+    pool_recycle=3600,
+    connect_args=connect_args
 )
 
 # Create session factory
-AsyncSessionLocal = sessionmaker(
+AsyncSessionLocal = async_sessionmaker(
     engine,
-    class_=AsyncSession,
-    expire_on_commit=False
+    expire_on_commit=False,
+    autoflush=False
 )
 
 # Create base class for models
 Base = declarative_base()
 
+# Columns and indexes the hot queries rely on, created alongside the tables
+MEDIA_DDL = [
+    # keyword_search: full-text vector over the searchable text columns. The
+    # parser keeps "sunset_beach.jpg" as one file token, so split filenames
+    # on separators first to make "beach" match
+    "ALTER TABLE media ADD COLUMN IF NOT EXISTS search_tsv tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', "
+    "regexp_replace(coalesce(original_filename, ''), '[._-]+', ' ', 'g') || ' ' || "
+    "coalesce(title, '') || ' ' || "
+    "coalesce(description, '') || ' ' || coalesce(caption, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_media_search_tsv "
+    "ON media USING GIN (search_tsv)",
+    # list_media: filter by owner/type, newest first
+    "CREATE INDEX IF NOT EXISTS ix_media_user_type_created "
+    "ON media (user_id, file_type, created_at DESC)",
+    # Tag queries against the ai_tags JSONB array
+    "CREATE INDEX IF NOT EXISTS ix_media_ai_tags_gin "
+    "ON media USING GIN (ai_tags jsonb_path_ops)",
+]
+
 # Dependency to get DB session
 async def get_db():
     async with AsyncSessionLocal() as session:
-        try:
-            yield session
-        finally:
-            await session.close() 
\ No newline at end of file
+        yield session 
\ No newline at end of file
@@ -1,10 +1,12 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
+from sqlalchemy import text
 import logging
 
 from core.config import settings
-from core.database import engine, Base
+from core.database import engine, Base, MEDIA_DDL
 
 # Configure logging
 logging.basicConfig(
@@ -19,14 +21,39 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting up...")
+    if settings.RUN_MIGRATIONS:
+        try:
+            # Create database tables
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            logger.info("Database tables created successfully")
+        except Exception as e:
+            logger.error(f"Error creating database tables: {e}")
+            # Continue anyway - tables might already exist
+        
+        # Extra columns and indexes, each in its own transaction so one
+        # failure doesn't roll back the tables or the other statements
+        for ddl in MEDIA_DDL:
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(text(ddl))
+            except Exception as e:
+                logger.error(f"Error running schema statement {ddl[:60]!r}: {e}")
+    
     try:
-        # Create database tables
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-        logger.info("Database tables created successfully")
+        # Make sure the storage bucket exists (once per worker, not per import)
+        from services.storage_service import storage_service
+        await asyncio.to_thread(storage_service.ensure_bucket)
     except Exception as e:
-        logger.error(f"Error creating database tables: {e}")
-        # Continue anyway - tables might already exist
+        logger.error(f"Error ensuring storage bucket: {e}")
+    
+    try:
+        # Load and warm AI models before serving the first request
+        from services.ai_service import ai_service
+        await ai_service.warmup()
+    except Exception as e:
+        logger.error(f"Error warming up AI models: {e}")
+        # Continue anyway - models load lazily on first use
     
     yield
     
@@ -40,13 +67,16 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# Set up CORS - simplified for testing
+# Set up CORS from the configured origins
+_ALLOWED_ORIGINS = [str(origin) for origin in settings.BACKEND_CORS_ORIGINS]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins for testing
+    allow_origins=_ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=600,  # Let browsers cache preflight responses
 )
 
 # Import routers with error handling
@@ -59,6 +89,9 @@ try:
     logger.info("All routers loaded successfully")
 except Exception as e:
     logger.error(f"Error loading routers: {e}")
+    if settings.PRODUCTION:
+        # Fail fast rather than serve an API with missing endpoints
+        raise
 
 
 @app.get("/")
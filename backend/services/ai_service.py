@@ -3,37 +3,106 @@ import clip
 from PIL import Image
 from transformers import BlipProcessor, BlipForConditionalGeneration
 import numpy as np
-from typing import List, Dict, Tuple
+import asyncio
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import List, Dict, Set, Tuple, Union
 import logging
 from core.config import settings
 
 logger = logging.getLogger(__name__)
 
 
+ImageSource = Union[str, Image.Image]
+
+# Caption words of three or more characters are tag candidates
+_TAG_WORD_RE = re.compile(r"\b\w{3,}\b")
+
+# Common stop words to filter out
+_STOP_WORDS = frozenset({
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'in', 'on',
+    'at', 'to', 'for', 'of', 'with', 'by', 'from', 'and', 'or'
+})
+
+
 class AIService:
     def __init__(self):
         self.device = settings.DEVICE
+        self.use_cuda = self.device.startswith("cuda")
+        # Half precision on GPU; CPU weights stay fp32 (autocast may still use bf16)
+        self.model_dtype = torch.float16 if self.use_cuda else torch.float32
         self.clip_model = None
         self.clip_preprocess = None
         self.blip_processor = None
         self.blip_model = None
-        self._initialize_models()
+        # Separate CUDA stream so small text encodes don't queue behind image batches
+        self._text_stream = None
+        # PIL decoding releases the GIL, so images can be opened in parallel
+        self._decode_pool = ThreadPoolExecutor(max_workers=4)
+        # Model forward passes from async callers run here, one at a time
+        self._inference_pool = ThreadPoolExecutor(max_workers=1)
+        # Embeddings of popular search prompts, encoded once at startup
+        self._prompt_bank: Dict[str, np.ndarray] = {}
+        # Models load on first use (or warmup) rather than at import
+        self._models_lock = threading.Lock()
+        self._models_ready = False
+    
+    def _ensure_models(self):
+        """Load the models once, on whichever thread needs them first"""
+        if self._models_ready:
+            return
+        with self._models_lock:
+            if not self._models_ready:
+                self._initialize_models()
+                self._models_ready = True
+                # Encoding the bank calls back into _ensure_models, so only
+                # do it once the models are marked ready
+                self._load_prompt_bank()
+    
+    async def warmup(self):
+        """Load models and run one dummy pass per model off the event loop"""
+        await self._run_inference(self._warmup)
+    
+    async def _run_inference(self, func, *args):
+        """Run a blocking model call on the inference thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._inference_pool, func, *args)
+    
+    def _warmup(self):
+        self._ensure_models()
+        # Materialize CUDA context and kernel choices before the first request
+        dummy = Image.new("RGB", (224, 224))
+        self.extract_image_embedding(dummy)
+        self.generate_caption(dummy)
+        self.encode_texts(["warmup"])
+        logger.info("AI models warmed up")
     
     def _initialize_models(self):
         """Initialize AI models"""
         try:
+            if self.use_cuda:
+                # Let cuDNN pick the fastest kernels for our fixed input sizes
+                torch.backends.cudnn.benchmark = True
+                torch.set_float32_matmul_precision("high")
+                self._text_stream = torch.cuda.Stream()
+            
             # Load CLIP model
             logger.info(f"Loading CLIP model: {settings.CLIP_MODEL_NAME}")
             self.clip_model, self.clip_preprocess = clip.load(
                 settings.CLIP_MODEL_NAME, 
                 device=self.device
             )
+            if self.use_cuda:
+                self.clip_model = self.clip_model.half()
             
             # Load BLIP model for captioning
             logger.info(f"Loading BLIP model: {settings.BLIP_MODEL_NAME}")
             self.blip_processor = BlipProcessor.from_pretrained(settings.BLIP_MODEL_NAME)
             self.blip_model = BlipForConditionalGeneration.from_pretrained(
-                settings.BLIP_MODEL_NAME
+                settings.BLIP_MODEL_NAME,
+                torch_dtype=self.model_dtype
             ).to(self.device)
             
             logger.info("AI models initialized successfully")
@@ -41,28 +110,73 @@ class AIService:
             logger.error(f"Error initializing AI models: {str(e)}")
             raise
     
-    def extract_image_embedding(self, image_path: str) -> np.ndarray:
-        """Extract CLIP embedding from image"""
+    def _load_image(self, image: ImageSource) -> Image.Image:
+        """Open an image path, or pass through an already decoded image"""
+        if isinstance(image, Image.Image):
+            return image.convert("RGB") if image.mode != "RGB" else image
+        return Image.open(image).convert("RGB")
+    
+    def _autocast(self):
+        """Mixed-precision context for forward passes"""
+        if self.use_cuda:
+            return torch.autocast(device_type="cuda", dtype=torch.float16)
+        if settings.AI_CPU_BF16:
+            return torch.autocast(device_type="cpu", dtype=torch.bfloat16)
+        return nullcontext()
+    
+    def extract_image_embeddings_batch(
+        self,
+        image_paths: List[ImageSource],
+        batch_size: int = 32
+    ) -> np.ndarray:
+        """Extract normalized CLIP embeddings for many images, one forward pass per batch"""
+        self._ensure_models()
         try:
-            image = Image.open(image_path).convert("RGB")
-            image_input = self.clip_preprocess(image).unsqueeze(0).to(self.device)
+            if not image_paths:
+                return np.empty((0, self.clip_model.visual.output_dim), dtype=np.float32)
+            
+            images = list(self._decode_pool.map(self._load_image, image_paths))
             
-            with torch.no_grad():
-                image_features = self.clip_model.encode_image(image_input)
-                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+            embeddings = []
+            for start in range(0, len(images), batch_size):
+                image_input = torch.stack([
+                    self.clip_preprocess(image)
+                    for image in images[start:start + batch_size]
+                ]).to(self.device)
+                
+                with torch.inference_mode(), self._autocast():
+                    image_features = self.clip_model.encode_image(image_input)
+                    image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                
+                # Back to fp32 so downstream cosine math stays stable
+                embeddings.append(image_features.float().cpu().numpy())
             
-            return image_features.cpu().numpy().flatten()
+            return np.concatenate(embeddings)
         except Exception as e:
-            logger.error(f"Error extracting embedding: {str(e)}")
+            logger.error(f"Error extracting embeddings: {str(e)}")
             raise
     
-    def generate_caption(self, image_path: str) -> str:
+    def extract_image_embedding(self, image_path: ImageSource) -> np.ndarray:
+        """Extract CLIP embedding from image"""
+        return self.extract_image_embeddings_batch([image_path])[0]
+    
+    async def aextract_image_embedding(self, image_path: ImageSource) -> np.ndarray:
+        """Extract CLIP embedding from image without blocking the event loop"""
+        if isinstance(image_path, str):
+            # Decode on the CPU pool so the inference thread only runs the model
+            image_path = await asyncio.get_running_loop().run_in_executor(
+                self._decode_pool, self._load_image, image_path
+            )
+        return await self._run_inference(self.extract_image_embedding, image_path)
+    
+    def generate_caption(self, image_path: ImageSource) -> str:
         """Generate caption using BLIP"""
+        self._ensure_models()
         try:
-            image = Image.open(image_path).convert("RGB")
-            inputs = self.blip_processor(image, return_tensors="pt").to(self.device)
+            image = self._load_image(image_path)
+            inputs = self.blip_processor(image, return_tensors="pt").to(self.device, self.model_dtype)
             
-            with torch.no_grad():
+            with torch.inference_mode(), self._autocast():
                 out = self.blip_model.generate(**inputs, max_length=50)
                 caption = self.blip_processor.decode(out[0], skip_special_tokens=True)
             
@@ -71,73 +185,120 @@ class AIService:
             logger.error(f"Error generating caption: {str(e)}")
             raise
     
-    def extract_tags_from_caption(self, caption: str) -> List[str]:
-        """Extract relevant tags from caption"""
+    async def agenerate_caption(self, image_path: ImageSource) -> str:
+        """Generate caption without blocking the event loop"""
+        if isinstance(image_path, str):
+            image_path = await asyncio.get_running_loop().run_in_executor(
+                self._decode_pool, self._load_image, image_path
+            )
+        return await self._run_inference(self.generate_caption, image_path)
+    
+    def _caption_tag_set(self, caption: str) -> Set[str]:
         # Simple implementation - can be enhanced with NLP
-        import re
-        
-        # Common stop words to filter out
-        stop_words = {
-            'a', 'an', 'the', 'is', 'are', 'was', 'were', 'in', 'on', 
-            'at', 'to', 'for', 'of', 'with', 'by', 'from', 'and', 'or'
+        return {
+            word for word in _TAG_WORD_RE.findall(caption.lower())
+            if word not in _STOP_WORDS
         }
-        
-        # Extract words
-        words = re.findall(r'\b\w+\b', caption.lower())
-        
-        # Filter and return unique tags
-        tags = []
-        for word in words:
-            if len(word) > 2 and word not in stop_words:
-                tags.append(word)
-        
-        return list(set(tags))
-    
-    def process_image(self, image_path: str) -> Dict:
+    
+    def extract_tags_from_caption(self, caption: str) -> List[str]:
+        """Extract relevant tags from caption"""
+        return list(self._caption_tag_set(caption))
+    
+    def process_image_array(self, image_array: np.ndarray) -> Dict:
+        """Process an RGB pixel array (e.g. a decoded video frame)"""
+        return self.process_image(Image.fromarray(image_array))
+    
+    def process_image(self, image_path: ImageSource) -> Dict:
         """Process image to extract all AI metadata"""
         try:
+            # Decode once; captioning and embedding share the same image
+            image = self._load_image(image_path)
+            
             # Generate caption
-            caption = self.generate_caption(image_path)
+            caption = self.generate_caption(image)
             
             # Extract embedding
-            embedding = self.extract_image_embedding(image_path)
+            embedding = self.extract_image_embedding(image)
             
             # Extract tags from caption
-            tags = self.extract_tags_from_caption(caption)
+            tags = self._caption_tag_set(caption)
             
             # Add object detection tags (simplified for now)
             # In production, you'd use a proper object detection model
-            object_tags = self._detect_objects(image_path)
-            tags.extend(object_tags)
+            tags.update(self._detect_objects(image))
             
             return {
                 "caption": caption,
-                "embedding": embedding.tolist(),
-                "tags": list(set(tags)),
+                # Left as an fp32 array; the vector layer converts at its boundary
+                "embedding": embedding,
+                "tags": list(tags),
                 "embedding_dim": len(embedding)
             }
         except Exception as e:
             logger.error(f"Error processing image: {str(e)}")
             raise
     
-    def _detect_objects(self, image_path: str) -> List[str]:
+    def _detect_objects(self, image_path: ImageSource) -> List[str]:
         """Placeholder for object detection - would use YOLO or similar in production"""
         # This is a simplified version - in production, use proper object detection
         return []
     
-    def search_by_text(self, query: str) -> np.ndarray:
-        """Convert text query to CLIP embedding for search"""
+    def encode_texts(self, queries: List[str]) -> np.ndarray:
+        """Encode text queries to normalized CLIP embeddings in one forward pass"""
+        self._ensure_models()
         try:
-            text = clip.tokenize([query]).to(self.device)
+            text = clip.tokenize(queries)
             
-            with torch.no_grad():
+            if self._text_stream is None:
+                text = text.to(self.device)
+                stream = nullcontext()
+            else:
+                stream = torch.cuda.stream(self._text_stream)
+            
+            with stream, torch.inference_mode(), self._autocast():
+                if self._text_stream is not None:
+                    text = text.pin_memory().to(self.device, non_blocking=True)
                 text_features = self.clip_model.encode_text(text)
                 text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+                # Back to fp32 so downstream cosine math stays stable
+                text_features = text_features.float().cpu()
             
-            return text_features.cpu().numpy().flatten()
+            return text_features.numpy()
         except Exception as e:
             logger.error(f"Error encoding text: {str(e)}")
             raise
+    
+    def _load_prompt_bank(self):
+        """Pre-encode the configured popular prompts (one per line) in a single batch"""
+        if not settings.PROMPT_BANK_PATH:
+            return
+        try:
+            with open(settings.PROMPT_BANK_PATH, encoding="utf-8") as f:
+                prompts = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+            if prompts:
+                self._prompt_bank = dict(zip(prompts, self.encode_texts(prompts)))
+            logger.info(f"Loaded {len(self._prompt_bank)} prompt bank embeddings")
+        except Exception as e:
+            # Search still works without the bank, just uncached
+            logger.error(f"Error loading prompt bank: {str(e)}")
+    
+    @lru_cache(maxsize=4096)
+    def _encode_text_cached(self, query: str) -> bytes:
+        # Immutable bytes so cached entries can't be modified by callers
+        return self.encode_texts([query])[0].tobytes()
+    
+    def search_by_text(self, query: str) -> np.ndarray:
+        """Convert text query to CLIP embedding for search"""
+        # The prompt bank is filled right after the models load
+        self._ensure_models()
+        embedding = self._prompt_bank.get(query)
+        if embedding is not None:
+            return embedding
+        return np.frombuffer(self._encode_text_cached(query), dtype=np.float32)
+    
+    async def asearch_by_text(self, query: str) -> np.ndarray:
+        """Convert text query to CLIP embedding without blocking the event loop"""
+        return await self._run_inference(self.search_by_text, query)
 
 
 # Singleton instance
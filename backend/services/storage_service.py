@@ -1,8 +1,11 @@
 from minio import Minio
 from minio.error import S3Error
 import os
+import threading
 import uuid
-from typing import BinaryIO, Optional, Tuple
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 import logging
 from core.config import settings
 from PIL import Image
@@ -10,6 +13,17 @@ import io
 
 logger = logging.getLogger(__name__)
 
+# Large objects are sent as multipart uploads in parts of this size
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+# Cached presigned URLs are handed out until this many seconds before they expire
+URL_CACHE_MARGIN = 300
+URL_CACHE_SIZE = 50000
+
+# Existence checks are trusted for this many seconds
+STAT_CACHE_TTL = 60
+STAT_CACHE_SIZE = 10000
+
 
 class StorageService:
     def __init__(self):
@@ -19,10 +33,16 @@ class StorageService:
             secret_key=settings.MINIO_SECRET_KEY,
             secure=settings.MINIO_USE_SSL
         )
+        # The bucket is created once at startup (see ensure_bucket), not per import
         self.bucket_name = settings.MINIO_BUCKET_NAME
-        self._ensure_bucket()
+        self._url_executor = ThreadPoolExecutor(max_workers=8)
+        # Presigned URL caches, one per expiry so each gets a matching TTL
+        self._url_caches: Dict[int, TTLCache] = {}
+        # Objects recently confirmed to exist; only positive results are kept
+        self._stat_cache = TTLCache(maxsize=STAT_CACHE_SIZE, ttl=STAT_CACHE_TTL)
+        self._cache_lock = threading.Lock()
     
-    def _ensure_bucket(self):
+    def ensure_bucket(self):
         """Ensure storage bucket exists"""
         try:
             if not self.client.bucket_exists(self.bucket_name):
@@ -34,40 +54,75 @@ class StorageService:
             logger.error(f"Error ensuring bucket: {str(e)}")
             raise
     
+    def _new_object_name(self, original_filename: str, user_id: Optional[int]) -> str:
+        """Build a unique object name organized by user and date"""
+        # Generate unique filename
+        file_extension = os.path.splitext(original_filename)[1]
+        unique_filename = f"{uuid.uuid4()}{file_extension}"
+        
+        # Organize by user and date
+        from datetime import datetime
+        date_path = datetime.now().strftime("%Y/%m/%d")
+        
+        if user_id:
+            return f"users/{user_id}/{date_path}/{unique_filename}"
+        return f"public/{date_path}/{unique_filename}"
+    
     def upload_file(
         self, 
         file_data: BinaryIO, 
         original_filename: str,
         content_type: str,
-        user_id: Optional[int] = None
+        user_id: Optional[int] = None,
+        content_length: Optional[int] = None
     ) -> Tuple[str, int]:
-        """Upload file to storage and return path and size"""
+        """Upload file to storage and return path and size
+        
+        Streams of unknown length are sent as a multipart upload without
+        seeking, so they are never buffered whole.
+        """
         try:
-            # Generate unique filename
-            file_extension = os.path.splitext(original_filename)[1]
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
+            object_name = self._new_object_name(original_filename, user_id)
             
-            # Organize by user and date
-            from datetime import datetime
-            date_path = datetime.now().strftime("%Y/%m/%d")
+            # Upload file
+            self.client.put_object(
+                self.bucket_name,
+                object_name,
+                file_data,
+                content_length if content_length is not None else -1,
+                content_type=content_type,
+                part_size=MULTIPART_PART_SIZE
+            )
             
-            if user_id:
-                object_name = f"users/{user_id}/{date_path}/{unique_filename}"
+            if content_length is None:
+                file_size = self.client.stat_object(self.bucket_name, object_name).size
             else:
-                object_name = f"public/{date_path}/{unique_filename}"
+                file_size = content_length
             
-            # Get file size
-            file_data.seek(0, 2)  # Seek to end
-            file_size = file_data.tell()
-            file_data.seek(0)  # Reset to beginning
+            logger.info(f"Uploaded file: {object_name}")
+            return object_name, file_size
+        except Exception as e:
+            logger.error(f"Error uploading file: {str(e)}")
+            raise
+    
+    def upload_path(
+        self,
+        file_path: str,
+        original_filename: str,
+        content_type: str,
+        user_id: Optional[int] = None
+    ) -> Tuple[str, int]:
+        """Upload a local file to storage and return path and size"""
+        try:
+            object_name = self._new_object_name(original_filename, user_id)
+            file_size = os.path.getsize(file_path)
             
-            # Upload file
-            self.client.put_object(
+            self.client.fput_object(
                 self.bucket_name,
                 object_name,
-                file_data,
-                file_size,
-                content_type=content_type
+                file_path,
+                content_type=content_type,
+                part_size=MULTIPART_PART_SIZE
             )
             
             logger.info(f"Uploaded file: {object_name}")
@@ -78,21 +133,34 @@ class StorageService:
     
     def generate_thumbnail(
         self, 
-        file_data: BinaryIO,
+        file_data: Union[BinaryIO, Image.Image],
         original_filename: str,
         max_size: Tuple[int, int] = (300, 300)
     ) -> Optional[str]:
-        """Generate and upload thumbnail for image"""
+        """Generate and upload thumbnail for image (file-like or already decoded)"""
         try:
-            # Open image
-            image = Image.open(file_data)
+            if isinstance(file_data, Image.Image):
+                # thumbnail() works in place, so resize into a new image instead
+                # of copying the caller's full-size one first
+                image = file_data
+                scale = min(max_size[0] / image.width, max_size[1] / image.height)
+                if scale < 1:
+                    image = image.resize(
+                        (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                        Image.Resampling.LANCZOS,
+                        reducing_gap=2.0
+                    )
+            else:
+                image = Image.open(file_data)
+                # Let libjpeg downscale while decoding (no-op for other formats)
+                image.draft("RGB", (max_size[0] * 2, max_size[1] * 2))
             
-            # Create thumbnail
-            image.thumbnail(max_size, Image.Resampling.LANCZOS)
+            # Create thumbnail; box-reduce first, then LANCZOS for the final step
+            image.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
             
-            # Save to bytes
+            # Save to bytes in a single encoder pass
             thumb_io = io.BytesIO()
-            image.save(thumb_io, format='JPEG', quality=85)
+            image.save(thumb_io, format='JPEG', quality=85, optimize=False, progressive=False)
             thumb_io.seek(0)
             
             # Upload thumbnail
@@ -100,7 +168,8 @@ class StorageService:
             thumb_path, _ = self.upload_file(
                 thumb_io,
                 thumb_filename,
-                "image/jpeg"
+                "image/jpeg",
+                content_length=thumb_io.getbuffer().nbytes
             )
             
             return thumb_path
@@ -110,21 +179,48 @@ class StorageService:
     
     def get_file_url(self, object_name: str, expires: int = 3600) -> str:
         """Get presigned URL for file access"""
+        # Short-lived URLs are not worth caching
+        cache = None
+        if expires > URL_CACHE_MARGIN + 60:
+            with self._cache_lock:
+                cache = self._url_caches.get(expires)
+                if cache is None:
+                    cache = TTLCache(maxsize=URL_CACHE_SIZE, ttl=expires - URL_CACHE_MARGIN)
+                    self._url_caches[expires] = cache
+                url = cache.get(object_name)
+            if url is not None:
+                return url
+        
         try:
             url = self.client.presigned_get_object(
                 self.bucket_name,
                 object_name,
                 expires=expires
             )
+            if cache is not None:
+                with self._cache_lock:
+                    cache[object_name] = url
             return url
         except Exception as e:
             logger.error(f"Error getting file URL: {str(e)}")
             raise
     
+    def get_file_urls_batch(self, object_names: List[str], expires: int = 3600) -> Dict[str, str]:
+        """Get presigned URLs for many files in one pass"""
+        # Duplicate paths are signed only once
+        unique_names = list(dict.fromkeys(object_names))
+        urls = self._url_executor.map(
+            lambda object_name: self.get_file_url(object_name, expires),
+            unique_names
+        )
+        return dict(zip(unique_names, urls))
+    
     def delete_file(self, object_name: str):
         """Delete file from storage"""
         try:
             self.client.remove_object(self.bucket_name, object_name)
+            with self._cache_lock:
+                self._stat_cache.pop(object_name, None)
             logger.info(f"Deleted file: {object_name}")
         except Exception as e:
             logger.error(f"Error deleting file: {str(e)}")
@@ -134,18 +230,41 @@ class StorageService:
         """Download file from storage"""
         try:
             response = self.client.get_object(self.bucket_name, object_name)
-            data = response.read()
-            response.close()
-            response.release_conn()
-            return data
+            try:
+                return response.read()
+            finally:
+                response.close()
+                response.release_conn()
         except Exception as e:
             logger.error(f"Error getting file: {str(e)}")
             raise
     
+    def stream_file(self, object_name: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Yield a stored file in chunks without holding it in memory
+        
+        Prefer redirecting clients to get_file_url() where possible so
+        bytes don't pass through the API at all.
+        """
+        try:
+            response = self.client.get_object(self.bucket_name, object_name)
+        except Exception as e:
+            logger.error(f"Error getting file: {str(e)}")
+            raise
+        try:
+            yield from response.stream(chunk_size)
+        finally:
+            response.close()
+            response.release_conn()
+    
     def file_exists(self, object_name: str) -> bool:
         """Check if file exists in storage"""
+        with self._cache_lock:
+            if object_name in self._stat_cache:
+                return True
         try:
             self.client.stat_object(self.bucket_name, object_name)
+            with self._cache_lock:
+                self._stat_cache[object_name] = True
             return True
         except S3Error as e:
             if e.code == 'NoSuchKey':
@@ -1,29 +1,50 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, Range
-from typing import List, Dict, Optional
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, Filter, FieldCondition, Range,
+    IsEmptyCondition, PayloadField, HnswConfigDiff, ScalarQuantization,
+    ScalarQuantizationConfig, ScalarType, SearchParams, QuantizationSearchParams,
+    MatchAny, MatchValue, PayloadSchemaType
+)
+from typing import List, Dict, Optional, Tuple, Union
+import numpy as np
 import uuid
 import logging
 from core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Vectors may arrive as plain lists or as numpy arrays from the AI service
+Embedding = Union[List[float], np.ndarray]
+
+# Search the quantized index, then rescore the top candidates with full vectors
+SEARCH_PARAMS = SearchParams(
+    hnsw_ef=128,
+    quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
+
 
 class VectorService:
     def __init__(self):
         # Support both local and cloud Qdrant
         if settings.QDRANT_API_KEY:
             # Qdrant Cloud configuration
-            self.client = QdrantClient(
-                url=f"https://{settings.QDRANT_HOST}",
-                api_key=settings.QDRANT_API_KEY,
-            )
+            client_kwargs = {
+                "url": f"https://{settings.QDRANT_HOST}",
+                "api_key": settings.QDRANT_API_KEY,
+            }
         else:
             # Local Qdrant configuration
-            self.client = QdrantClient(
-                host=settings.QDRANT_HOST,
-                port=settings.QDRANT_PORT
-            )
+            client_kwargs = {
+                "host": settings.QDRANT_HOST,
+                "port": settings.QDRANT_PORT,
+            }
+        client_kwargs["prefer_grpc"] = settings.QDRANT_PREFER_GRPC
+        client_kwargs["grpc_port"] = settings.QDRANT_GRPC_PORT
+        self.client = QdrantClient(**client_kwargs)
+        # Used from request handlers so Qdrant I/O doesn't block the event loop
+        self.async_client = AsyncQdrantClient(**client_kwargs)
         self.collection_name = settings.QDRANT_COLLECTION_NAME
+        
         self._ensure_collection()
     
     def _ensure_collection(self):
@@ -38,9 +59,32 @@ class VectorService:
                     collection_name=self.collection_name,
                     vectors_config=VectorParams(
                         size=512,  # CLIP ViT-B/32 dimension
-                        distance=Distance.COSINE
-                    )
+                        distance=Distance.COSINE,
+                        on_disk=True  # fp32 originals are memmapped, read only to rescore
+                    ),
+                    # int8 vectors stay in RAM for search; originals and graph live on disk
+                    quantization_config=ScalarQuantization(
+                        scalar=ScalarQuantizationConfig(
+                            type=ScalarType.INT8,
+                            quantile=0.99,
+                            always_ram=True
+                        )
+                    ),
+                    hnsw_config=HnswConfigDiff(m=16, ef_construct=128, on_disk=True),
+                    on_disk_payload=True
                 )
+                
+                # Index the filtered payload fields so filters use posting lists
+                for field_name, field_schema in (
+                    ("user_id", PayloadSchemaType.INTEGER),
+                    ("file_type", PayloadSchemaType.KEYWORD),
+                    ("tags", PayloadSchemaType.KEYWORD),
+                ):
+                    self.client.create_payload_index(
+                        collection_name=self.collection_name,
+                        field_name=field_name,
+                        field_schema=field_schema
+                    )
                 logger.info(f"Created collection: {self.collection_name}")
             else:
                 logger.info(f"Collection already exists: {self.collection_name}")
@@ -48,35 +92,113 @@ class VectorService:
             logger.error(f"Error ensuring collection: {str(e)}")
             raise
     
-    def add_embedding(self, embedding: List[float], media_id: int, metadata: Dict) -> str:
+    def _make_point(self, embedding: Embedding, media_id: int, metadata: Dict) -> PointStruct:
+        """Build a point with a fresh id and the standard payload"""
+        if isinstance(embedding, np.ndarray):
+            # With gRPC this list is sent as protobuf floats, not JSON
+            embedding = embedding.tolist()
+        return PointStruct(
+            id=str(uuid.uuid4()),
+            vector=embedding,
+            payload={
+                "media_id": media_id,
+                "user_id": metadata.get("user_id"),
+                "file_type": metadata.get("file_type", "image"),
+                "caption": metadata.get("caption", ""),
+                "tags": metadata.get("tags", []),
+                "filename": metadata.get("filename", ""),
+                "created_at": metadata.get("created_at", "")
+            }
+        )
+    
+    def add_embedding(self, embedding: Embedding, media_id: int, metadata: Dict) -> str:
         """Add embedding to vector database"""
         try:
-            point_id = str(uuid.uuid4())
+            point = self._make_point(embedding, media_id, metadata)
             
-            point = PointStruct(
-                id=point_id,
-                vector=embedding,
-                payload={
-                    "media_id": media_id,
-                    "file_type": metadata.get("file_type", "image"),
-                    "caption": metadata.get("caption", ""),
-                    "tags": metadata.get("tags", []),
-                    "filename": metadata.get("filename", ""),
-                    "created_at": metadata.get("created_at", "")
-                }
-            )
+            self._upsert_batch([point])
             
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=[point]
-            )
-            
-            logger.info(f"Added embedding {point_id} for media {media_id}")
-            return point_id
+            logger.info(f"Added embedding {point.id} for media {media_id}")
+            return point.id
         except Exception as e:
             logger.error(f"Error adding embedding: {str(e)}")
             raise
     
+    def add_embeddings_batch(self, items: List[Tuple[Embedding, int, Dict]]) -> List[str]:
+        """Add many (embedding, media_id, metadata) items in one upsert"""
+        try:
+            points = [self._make_point(embedding, media_id, metadata) for embedding, media_id, metadata in items]
+            if points:
+                self._upsert_batch(points)
+                logger.info(f"Added {len(points)} embeddings")
+            return [point.id for point in points]
+        except Exception as e:
+            logger.error(f"Error adding embeddings: {str(e)}")
+            raise
+    
+    def _upsert_batch(self, points: List[PointStruct]):
+        # Return once Qdrant has accepted the write into its WAL rather than
+        # after indexing; connection and validation errors still raise
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=points,
+            wait=False
+        )
+    
+    def _build_filter(self, filters: Optional[Dict]) -> Optional[Filter]:
+        """Build a Qdrant filter from search filters"""
+        if not filters:
+            return None
+        
+        conditions = []
+        
+        if "user_id" in filters:
+            # Points indexed before user_id was in the payload have none;
+            # let those through and leave ownership to the database lookup
+            conditions.append(
+                Filter(should=[
+                    FieldCondition(
+                        key="user_id",
+                        match=MatchValue(value=filters["user_id"])
+                    ),
+                    IsEmptyCondition(is_empty=PayloadField(key="user_id"))
+                ])
+            )
+        
+        if "file_type" in filters:
+            conditions.append(
+                FieldCondition(
+                    key="file_type",
+                    match=MatchValue(value=filters["file_type"])
+                )
+            )
+        
+        if "tags" in filters and filters["tags"]:
+            # Points having any of the requested tags
+            conditions.append(
+                FieldCondition(
+                    key="tags",
+                    match=MatchAny(any=filters["tags"])
+                )
+            )
+        
+        return Filter(must=conditions) if conditions else None
+    
+    def _format_results(self, results) -> List[Dict]:
+        """Format scored points for API consumers"""
+        formatted_results = []
+        for result in results:
+            formatted_results.append({
+                "id": result.id,
+                "score": result.score,
+                "media_id": result.payload.get("media_id"),
+                "caption": result.payload.get("caption"),
+                "tags": result.payload.get("tags", []),
+                "filename": result.payload.get("filename"),
+                "file_type": result.payload.get("file_type")
+            })
+        return formatted_results
+    
     def search_similar(
         self, 
         query_embedding: List[float], 
@@ -86,54 +208,37 @@ class VectorService:
     ) -> List[Dict]:
         """Search for similar media using embedding"""
         try:
-            # Build filter if provided
-            qdrant_filter = None
-            if filters:
-                conditions = []
-                
-                if "file_type" in filters:
-                    conditions.append(
-                        FieldCondition(
-                            key="file_type",
-                            match={"value": filters["file_type"]}
-                        )
-                    )
-                
-                if "tags" in filters and filters["tags"]:
-                    for tag in filters["tags"]:
-                        conditions.append(
-                            FieldCondition(
-                                key="tags",
-                                match={"any": [tag]}
-                            )
-                        )
-                
-                if conditions:
-                    qdrant_filter = Filter(must=conditions)
-            
-            # Perform search
             results = self.client.search(
                 collection_name=self.collection_name,
                 query_vector=query_embedding,
                 limit=limit,
                 score_threshold=score_threshold,
-                query_filter=qdrant_filter
+                query_filter=self._build_filter(filters),
+                search_params=SEARCH_PARAMS
             )
-            
-            # Format results
-            formatted_results = []
-            for result in results:
-                formatted_results.append({
-                    "id": result.id,
-                    "score": result.score,
-                    "media_id": result.payload.get("media_id"),
-                    "caption": result.payload.get("caption"),
-                    "tags": result.payload.get("tags", []),
-                    "filename": result.payload.get("filename"),
-                    "file_type": result.payload.get("file_type")
-                })
-            
-            return formatted_results
+            return self._format_results(results)
+        except Exception as e:
+            logger.error(f"Error searching similar: {str(e)}")
+            raise
+    
+    async def async_search_similar(
+        self, 
+        query_embedding: List[float], 
+        limit: int = 20,
+        score_threshold: float = 0.7,
+        filters: Optional[Dict] = None
+    ) -> List[Dict]:
+        """Search for similar media using embedding (async)"""
+        try:
+            results = await self.async_client.search(
+                collection_name=self.collection_name,
+                query_vector=query_embedding,
+                limit=limit,
+                score_threshold=score_threshold,
+                query_filter=self._build_filter(filters),
+                search_params=SEARCH_PARAMS
+            )
+            return self._format_results(results)
         except Exception as e:
             logger.error(f"Error searching similar: {str(e)}")
             raise
@@ -150,10 +255,35 @@ class VectorService:
             logger.error(f"Error deleting embedding: {str(e)}")
             raise
     
+    async def async_delete_embedding(self, embedding_id: str):
+        """Delete embedding from vector database (async)"""
+        try:
+            await self.async_client.delete(
+                collection_name=self.collection_name,
+                points_selector=[embedding_id]
+            )
+            logger.info(f"Deleted embedding: {embedding_id}")
+        except Exception as e:
+            logger.error(f"Error deleting embedding: {str(e)}")
+            raise
+    
     def update_metadata(self, embedding_id: str, metadata: Dict):
         """Update metadata for existing embedding"""
         try:
-            self.client.update_payload(
+            self.client.set_payload(
+                collection_name=self.collection_name,
+                payload=metadata,
+                points=[embedding_id]
+            )
+            logger.info(f"Updated metadata for embedding: {embedding_id}")
+        except Exception as e:
+            logger.error(f"Error updating metadata: {str(e)}")
+            raise
+    
+    async def async_update_metadata(self, embedding_id: str, metadata: Dict):
+        """Update metadata for existing embedding (async)"""
+        try:
+            await self.async_client.set_payload(
                 collection_name=self.collection_name,
                 payload=metadata,
                 points=[embedding_id]